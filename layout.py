@@ -1,12 +1,14 @@
 import argparse
 import configparser
+import functools
 import math
 import os
 import sys
-from typing import List, Tuple, Optional, Dict, Any
+from typing import Callable, List, Tuple, Optional, Dict, Any
 
+import numpy as np
 import reportlab
-from PIL import Image, ImageDraw, UnidentifiedImageError
+from PIL import Image, ImageColor
 from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
@@ -58,135 +60,163 @@ def load_config(config_path: str) -> configparser.ConfigParser:
     return config
 
 
+def _to_bool(value: str) -> bool:
+    """Converts a configuration string to a boolean, accepting the same values as ConfigParser.getboolean."""
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(f"Not a boolean: {value}") from None
+
+
+def _config_value(options: Dict[str, str], section: str, option: str, convert: Callable[[str], Any] = str) -> Any:
+    """Returns a converted option value, exiting with an error naming the option if it is missing or invalid."""
+    try:
+        return convert(options[option])
+    except KeyError:
+        print(f"Error: Option '{option}' missing from section [{section}] of the configuration file.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: Invalid value '{options[option]}' for option '{option}' in section [{section}].")
+        sys.exit(1)
+
+
 # --- PIL-related functions (Bleed) ---
 
 def _open_image(image_path: str) -> Tuple[Optional[Image.Image], Optional[int], Optional[int]]:
     """Opens the image and returns it, along with its width and height."""
     try:
         img = Image.open(image_path)
+        img.load()  # Decode now so truncated or corrupt files are reported here
         return img, img.width, img.height
-    except (FileNotFoundError, UnidentifiedImageError) as e:
+    except (OSError, Image.DecompressionBombError) as e:
         print(f"Error opening image: {e}")
         sys.exit(1)
 
 
-def _add_repeat_bleed(new_img: Image.Image, img: Image.Image, width: int, height: int, bleed_size: int):
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Converts the image to RGB, compositing any transparency onto white."""
+    if 'A' not in img.getbands() and 'transparency' not in img.info:
+        return img.convert('RGB')
+    flat = Image.new('RGB', img.size, 'white')
+    flat.paste(img.convert('RGB'), mask=img.convert('RGBA').getchannel('A'))
+    if 'dpi' in img.info:
+        flat.info['dpi'] = img.info['dpi']
+    return flat
+
+
+def _add_repeat_bleed(out: np.ndarray, arr: np.ndarray, width: int, height: int, bleed_size: int):
     """Adds bleed by repeating the edges."""
-    for i in range(bleed_size):
-        new_img.paste(img.crop((0, 0, 1, height)), (bleed_size - i - 1, bleed_size))
-        new_img.paste(img.crop((width - 1, 0, width, height)), (bleed_size + width + i, bleed_size))
-        new_img.paste(img.crop((0, 0, width, 1)), (bleed_size, bleed_size - i - 1))
-        new_img.paste(img.crop((0, height - 1, width, height)), (bleed_size, bleed_size + height + i))
-        new_img.paste(img.crop((0, 0, 1, 1)), (bleed_size - i - 1, bleed_size - i - 1))
-        new_img.paste(img.crop((width - 1, 0, width, 1)), (bleed_size + width + i, bleed_size - i - 1))
-        new_img.paste(img.crop((0, height - 1, 1, height)), (bleed_size - i - 1, bleed_size + height + i))
-        new_img.paste(img.crop((width - 1, height - 1, width, height)),
-                      (bleed_size + width + i, bleed_size + height + i))
-
-
-def _add_mirror_bleed(new_img: Image.Image, img: Image.Image, width: int, height: int, bleed_size: int):
+    b = bleed_size
+    # Edges: broadcast the outermost row/column across the bleed strip
+    out[b:b + height, :b] = arr[:, 0:1]
+    out[b:b + height, b + width:] = arr[:, width - 1:width]
+    out[:b, b:b + width] = arr[0:1, :]
+    out[b + height:, b:b + width] = arr[height - 1:height, :]
+    # Corners: fill with the corner pixel
+    out[:b, :b] = arr[0, 0]
+    out[:b, b + width:] = arr[0, -1]
+    out[b + height:, :b] = arr[-1, 0]
+    out[b + height:, b + width:] = arr[-1, -1]
+
+
+def _add_mirror_bleed(out: np.ndarray, arr: np.ndarray, width: int, height: int, bleed_size: int):
     """Adds bleed by mirroring the edges."""
-    new_img.paste(img.crop((0, 0, bleed_size, height)).transpose(Image.FLIP_LEFT_RIGHT), (0, bleed_size))
-    new_img.paste(img.crop((width - bleed_size, 0, width, height)).transpose(Image.FLIP_LEFT_RIGHT),
-                  (width + bleed_size, bleed_size))
-    new_img.paste(img.crop((0, 0, width, bleed_size)).transpose(Image.FLIP_TOP_BOTTOM), (bleed_size, 0))
-    new_img.paste(img.crop((0, height - bleed_size, width, height)).transpose(Image.FLIP_TOP_BOTTOM),
-                  (bleed_size, height + bleed_size))
+    if bleed_size > width or bleed_size > height:
+        raise ValueError("bleed_size cannot exceed the image width or height in mirror mode")
+    b = bleed_size
+    # Edges: reversed views of the strips next to each edge
+    out[b:b + height, :b] = np.fliplr(arr[:, :b])
+    out[b:b + height, b + width:] = np.fliplr(arr[:, width - b:])
+    out[:b, b:b + width] = np.flipud(arr[:b, :])
+    out[b + height:, b:b + width] = np.flipud(arr[height - b:, :])
+    # Corners: mirror the corner blocks in both directions
+    out[:b, :b] = np.flip(arr[:b, :b], (0, 1))
+    out[:b, b + width:] = np.flip(arr[:b, width - b:], (0, 1))
+    out[b + height:, :b] = np.flip(arr[height - b:, :b], (0, 1))
+    out[b + height:, b + width:] = np.flip(arr[height - b:, width - b:], (0, 1))
+
+
+BleedFunction = Callable[[np.ndarray, np.ndarray, int, int, int], None]
+
+_BLEED_MODES: Dict[str, BleedFunction] = {
+    'repeat': _add_repeat_bleed,
+    'mirror': _add_mirror_bleed,
+}
 
 
 def _create_new_image_with_bleed(img: Image.Image, width: int, height: int, bleed_size: int,
-                                 bleed_mode: str) -> Tuple[Image.Image, int, int]:
-    """Creates a new image with the specified bleed."""
+                                 bleed_fn: BleedFunction) -> Tuple[np.ndarray, int, int]:
+    """Creates a new RGB pixel array with the specified bleed."""
     new_width = width + 2 * bleed_size
     new_height = height + 2 * bleed_size
-    new_img = Image.new("RGB", (new_width, new_height), "white")
-    new_img.paste(img, (bleed_size, bleed_size))
+    arr = np.asarray(img.convert("RGB"))
+    out = np.empty((new_height, new_width, 3), dtype=arr.dtype)
+    out[bleed_size:bleed_size + height, bleed_size:bleed_size + width] = arr
+
+    bleed_fn(out, arr, width, height, bleed_size)
+    return out, new_width, new_height
+
+
+def _draw_line(pixels: np.ndarray, x1: int, y1: int, x2: int, y2: int, color: str = "black", width: int = 2):
+    """Draws a horizontal or vertical line as a filled box, handling per-pixel inversion."""
+    if x1 != x2 and y1 != y2:
+        raise ValueError("Only horizontal and vertical lines are supported")
+
+    # Box covered by a width x width stamp walked from (x1, y1) to (x2, y2).
+    # Slicing clips stops past the far edges, but negative bounds would wrap around: clamp the
+    # starts and skip boxes that end before the image does.
+    left = max(min(x1, x2) - width // 2, 0)
+    top = max(min(y1, y2) - width // 2, 0)
+    right = max(x1, x2) + (width + 1) // 2
+    bottom = max(y1, y2) + (width + 1) // 2
+    if left >= right or top >= bottom:
+        return
 
-    if bleed_mode == 'repeat':
-        _add_repeat_bleed(new_img, img, width, height, bleed_size)
-    elif bleed_mode == 'mirror':
-        _add_mirror_bleed(new_img, img, width, height, bleed_size)
+    region = pixels[top:bottom, left:right]
+    if color.lower() == 'inverted':
+        region ^= 0xFF
     else:
-        raise ValueError("bleed_mode must be 'repeat' or 'mirror'")
+        region[:] = ImageColor.getrgb(color)[:3]
 
-    return new_img, new_width, new_height
 
-
-def _draw_line(draw: ImageDraw.ImageDraw, x1: int, y1: int, x2: int, y2: int, image_width: int, image_height: int,
-               color: str = "black", width: int = 2):
-    """Draws a line using Bresenham's algorithm, handling per-pixel inversion."""
-    dx, dy = abs(x2 - x1), abs(y2 - y1)
-    sx, sy = 1 if x1 < x2 else -1, 1 if y1 < y2 else -1
-    err = (dx if dx > dy else -dy) / 2
-
-    temp_img = draw._image.copy()  # Make a copy of the image
-    while True:
-        if 0 <= x1 < image_width and 0 <= y1 < image_height:
-            for i in range(-(width // 2), (width + 1) // 2):
-                for j in range(-(width // 2), (width + 1) // 2):
-                    px, py = x1 + i, y1 + j
-                    # Bounds check is still needed *inside* the loop
-                    if 0 <= px < image_width and 0 <= py < image_height:
-                        if color.lower() == 'inverted':
-                            r, g, b = temp_img.getpixel((px, py))  # Read color from (px, py)
-                            chosen_color = (255 - r, 255 - g, 255 - b)
-                        else:
-                            chosen_color = color
-                        draw.point((px, py), fill=chosen_color)
-        if x1 == x2 and y1 == y2:
-            break
-        e2 = err
-        if e2 > -dx:
-            err -= dy
-            x1 += sx
-        if e2 < dy:
-            err += dx
-            y1 += sy
-
-
-def _draw_bleed_crop_marks(draw: ImageDraw.ImageDraw, image_width: int, image_height: int, bleed_size: int,
+def _draw_bleed_crop_marks(pixels: np.ndarray, image_width: int, image_height: int, bleed_size: int,
                            crop_mark_length: int, cut_mark_length: int, crop_mark_color: str):
     """Draws crop and cut marks for bleed."""
-    _draw_line(draw, bleed_size - crop_mark_length, bleed_size, bleed_size, bleed_size, image_width, image_height,
+    _draw_line(pixels, bleed_size - crop_mark_length, bleed_size, bleed_size, bleed_size,
                color=crop_mark_color, width=2)
-    _draw_line(draw, bleed_size, bleed_size - crop_mark_length, bleed_size, bleed_size, image_width, image_height,
+    _draw_line(pixels, bleed_size, bleed_size - crop_mark_length, bleed_size, bleed_size,
                color=crop_mark_color, width=2)
-    _draw_line(draw, image_width - bleed_size, bleed_size - crop_mark_length, image_width - bleed_size, bleed_size,
-               image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width - bleed_size, bleed_size, image_width - bleed_size + crop_mark_length, bleed_size,
-               image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, bleed_size - crop_mark_length, image_height - bleed_size, bleed_size, image_height - bleed_size,
-               image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, bleed_size, image_height - bleed_size, bleed_size,
-               image_height - bleed_size + crop_mark_length, image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width - bleed_size, image_height - bleed_size, image_width - bleed_size + crop_mark_length,
-               image_height - bleed_size, image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width - bleed_size, image_height - bleed_size, image_width - bleed_size,
-               image_height - bleed_size + crop_mark_length, image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width // 2 - cut_mark_length // 2, bleed_size, image_width // 2 + cut_mark_length // 2,
-               bleed_size, image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width // 2 - cut_mark_length // 2, image_height - bleed_size,
-               image_width // 2 + cut_mark_length // 2, image_height - bleed_size, image_width, image_height,
+    _draw_line(pixels, image_width - bleed_size, bleed_size - crop_mark_length, image_width - bleed_size, bleed_size,
                color=crop_mark_color, width=2)
-    _draw_line(draw, bleed_size, image_height // 2 - cut_mark_length // 2, bleed_size,
-               image_height // 2 + cut_mark_length // 2, image_width, image_height, color=crop_mark_color, width=2)
-    _draw_line(draw, image_width - bleed_size, image_height // 2 - cut_mark_length // 2, image_width - bleed_size,
-               image_height // 2 + cut_mark_length // 2, image_width, image_height, color=crop_mark_color, width=2)
-
-
-def add_bleed_and_marks(image_path: str, bleed_size: int, crop_mark_length: int,
-                        crop_mark_color: str, bleed_mode: str, cut_mark_length: int) -> Optional[Image.Image]:
+    _draw_line(pixels, image_width - bleed_size, bleed_size, image_width - bleed_size + crop_mark_length, bleed_size,
+               color=crop_mark_color, width=2)
+    _draw_line(pixels, bleed_size - crop_mark_length, image_height - bleed_size, bleed_size, image_height - bleed_size,
+               color=crop_mark_color, width=2)
+    _draw_line(pixels, bleed_size, image_height - bleed_size, bleed_size,
+               image_height - bleed_size + crop_mark_length, color=crop_mark_color, width=2)
+    _draw_line(pixels, image_width - bleed_size, image_height - bleed_size, image_width - bleed_size + crop_mark_length,
+               image_height - bleed_size, color=crop_mark_color, width=2)
+    _draw_line(pixels, image_width - bleed_size, image_height - bleed_size, image_width - bleed_size,
+               image_height - bleed_size + crop_mark_length, color=crop_mark_color, width=2)
+    _draw_line(pixels, image_width // 2 - cut_mark_length // 2, bleed_size, image_width // 2 + cut_mark_length // 2,
+               bleed_size, color=crop_mark_color, width=2)
+    _draw_line(pixels, image_width // 2 - cut_mark_length // 2, image_height - bleed_size,
+               image_width // 2 + cut_mark_length // 2, image_height - bleed_size, color=crop_mark_color, width=2)
+    _draw_line(pixels, bleed_size, image_height // 2 - cut_mark_length // 2, bleed_size,
+               image_height // 2 + cut_mark_length // 2, color=crop_mark_color, width=2)
+    _draw_line(pixels, image_width - bleed_size, image_height // 2 - cut_mark_length // 2, image_width - bleed_size,
+               image_height // 2 + cut_mark_length // 2, color=crop_mark_color, width=2)
+
+
+def add_bleed_and_marks(img: Image.Image, bleed_size: int, crop_mark_length: int,
+                        crop_mark_color: str, bleed_fn: BleedFunction, cut_mark_length: int) -> Optional[Image.Image]:
     """Adds bleed and crop marks to the image. Returns the modified image object, or None on failure. [Bleed]"""
-    img, width, height = _open_image(image_path)
-    if img is None:
-        return None
-
+    width, height = img.size
     try:
-        new_img, new_width, new_height = _create_new_image_with_bleed(img, width, height, bleed_size, bleed_mode)
-        draw = ImageDraw.Draw(new_img)
-        _draw_bleed_crop_marks(draw, new_width, new_height, bleed_size, crop_mark_length, cut_mark_length,
+        pixels, new_width, new_height = _create_new_image_with_bleed(img, width, height, bleed_size, bleed_fn)
+        _draw_bleed_crop_marks(pixels, new_width, new_height, bleed_size, crop_mark_length, cut_mark_length,
                                crop_mark_color)
-        return new_img
+        return Image.fromarray(pixels)
     except Exception as e:
         print(f"Error adding bleed and marks: {e}")
         return None
@@ -227,27 +257,27 @@ def _calculate_layout(image_width_mm: float, image_height_mm: float, page_width:
     scale = min(max_width / image_width_mm, max_height / image_height_mm)
     scaled_width, scaled_height = image_width_mm * scale, image_height_mm * scale
 
-    image_positions = []
-    for row in range(rows):
-        for col in range(cols):
-            if (row * cols + col) < num_copies:
-                x = margin + col * (scaled_width + spacing)
-                y = page_height - margin - (row + 1) * (scaled_height + spacing)
-                image_positions.append((x, y))
+    row_idx, col_idx = np.divmod(np.arange(num_copies), cols)
+    xs = margin + col_idx * (scaled_width + spacing)
+    ys = page_height - margin - (row_idx + 1) * (scaled_height + spacing)
+    image_positions = list(zip(xs.tolist(), ys.tolist()))
 
     return cols, rows, scaled_width, scaled_height, image_positions
 
 
-def _draw_cut_marks(c: canvas.Canvas, x: float, y: float, width: float, height: float, mark_length: float = 5 * mm):
-    """Draws cut marks around a rectangle."""
-    c.line(x, y + height, x + mark_length, y + height)
-    c.line(x, y + height, x, y + height - mark_length)
-    c.line(x + width, y + height, x + width - mark_length, y + height)
-    c.line(x + width, y + height, x + width, y + height - mark_length)
-    c.line(x, y, x + mark_length, y)
-    c.line(x, y, x, y + mark_length)
-    c.line(x + width, y, x + width - mark_length, y)
-    c.line(x + width, y, x + width, y + mark_length)
+def _cut_mark_lines(x: float, y: float, width: float, height: float,
+                    mark_length: float = 5 * mm) -> List[Tuple[float, float, float, float]]:
+    """Returns the cut mark lines around a rectangle."""
+    return [
+        (x, y + height, x + mark_length, y + height),
+        (x, y + height, x, y + height - mark_length),
+        (x + width, y + height, x + width - mark_length, y + height),
+        (x + width, y + height, x + width, y + height - mark_length),
+        (x, y, x + mark_length, y),
+        (x, y, x, y + mark_length),
+        (x + width, y, x + width - mark_length, y),
+        (x + width, y, x + width, y + mark_length),
+    ]
 
 
 def _set_paper_size_and_orientation(paper_size_name: str, orientation: str) -> Tuple[float, float]:
@@ -273,10 +303,22 @@ def _draw_images_and_cut_marks(c: canvas.Canvas, img: Image.Image, image_positio
                                scaled_width: float, scaled_height: float, cut_marks: bool,
                                imposition_mark_length: float):
     """Draws the images and cut marks on the canvas."""
+    # Draw the image once into a form XObject, then stamp it at each position
+    c.beginForm("tile", upperx=scaled_width, uppery=scaled_height)
+    c.drawImage(ImageReader(img), 0, 0, width=scaled_width, height=scaled_height, mask=None)
+    c.endForm()
     for x, y in image_positions:
-        c.drawImage(ImageReader(img), x, y, width=scaled_width, height=scaled_height, mask='auto')
-        if cut_marks:
-            _draw_cut_marks(c, x, y, scaled_width, scaled_height, mark_length=imposition_mark_length * mm)
+        c.saveState()
+        c.translate(x, y)
+        c.doForm("tile")
+        c.restoreState()
+
+    if cut_marks:
+        # All cut marks for the page go out as a single path
+        lines = []
+        for x, y in image_positions:
+            lines.extend(_cut_mark_lines(x, y, scaled_width, scaled_height, mark_length=imposition_mark_length * mm))
+        c.lines(lines)
 
 
 def create_imposition_pdf(input_image: Image.Image, output_pdf_path: str, paper_size_name: str, orientation: str,
@@ -327,29 +369,39 @@ def main():
     config = load_config(args.config)
 
     # Bleed settings
-    bleed_size = config.getint('Bleed', 'bleed_size')
-    crop_mark_length = config.getint('Bleed', 'crop_mark_length')
-    crop_mark_color = config.get('Bleed', 'crop_mark_color')
-    bleed_mode = config.get('Bleed', 'bleed_mode')
-    cut_mark_length = config.getint('Bleed', 'cut_mark_length')
+    bleed = functools.partial(_config_value, dict(config.items('Bleed')), 'Bleed')
+    bleed_size = bleed('bleed_size', int)
+    crop_mark_length = bleed('crop_mark_length', int)
+    crop_mark_color = bleed('crop_mark_color')
+    bleed_mode = bleed('bleed_mode')
+    cut_mark_length = bleed('cut_mark_length', int)
 
     # Imposition settings
-    paper_size_name = config.get('Imposition', 'paper_size')
-    orientation = config.get('Imposition', 'orientation')
-    num_copies = config.getint('Imposition', 'num_copies')
-    cut_marks = config.getboolean('Imposition', 'cut_marks')
-    margin = config.getfloat('Imposition', 'margin') * mm
-    spacing = config.getfloat('Imposition', 'spacing') * mm
-    imposition_mark_length = config.getfloat('Imposition', 'imposition_mark_length')
+    imposition = functools.partial(_config_value, dict(config.items('Imposition')), 'Imposition')
+    paper_size_name = imposition('paper_size')
+    orientation = imposition('orientation')
+    num_copies = imposition('num_copies', int)
+    cut_marks = imposition('cut_marks', _to_bool)
+    margin = imposition('margin', float) * mm
+    spacing = imposition('spacing', float) * mm
+    imposition_mark_length = imposition('imposition_mark_length', float)
+
+    # Decode once up front; the same in-memory RGB image feeds both bleed and imposition,
+    # so drawImage needs no mask
+    img = _flatten_to_rgb(_open_image(args.input_image)[0])  # Get only the image part
 
     if bleed_size > 0:
-        processed_image = add_bleed_and_marks(args.input_image, bleed_size, crop_mark_length,
-                                              crop_mark_color, bleed_mode, cut_mark_length)
+        bleed_fn = _BLEED_MODES.get(bleed_mode)
+        if bleed_fn is None:
+            print("Error: bleed_mode must be 'repeat' or 'mirror'.")
+            sys.exit(1)
+        processed_image = add_bleed_and_marks(img, bleed_size, crop_mark_length,
+                                              crop_mark_color, bleed_fn, cut_mark_length)
         if processed_image is None:
             print("Failed to add bleed and marks. Exiting.")
             sys.exit(1)
     else:
-        processed_image = _open_image(args.input_image)[0]  # Get only the image part
+        processed_image = img
 
     create_imposition_pdf(processed_image, args.output_pdf, paper_size_name, orientation,
                           num_copies, cut_marks, margin, spacing, imposition_mark_length)